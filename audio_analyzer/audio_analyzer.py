@@ -1,20 +1,64 @@
 import os
+import sys
+import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from mutagen import File
 from mutagen.mp3 import MP3
 from mutagen.wave import WAVE
 import numpy as np
 import soundfile as sf
 
-def calculate_snr(audio_data):
-    """计算音频数据的信噪比"""
-    # 计算信号的均方值
-    signal_rms = np.mean(np.square(audio_data))
+try:
+    from numba import njit
+except ImportError:
+    # 未安装 numba 时退回 NumPy 向量化实现
+    njit = None
+
+# 计算 SNR 的帧长（样本数）
+FRAME_SIZE = 2048
+# 流式读取时每次读取的帧数，块内仍按帧向量化计算
+BLOCK_FRAMES = 256
+# 估计 SNR 时最多读取的时长（秒），足以估计且使每个文件的耗时基本恒定
+SNR_MAX_SECONDS = 30
+
+if njit is not None:
+    # 打包后的程序没有源码目录，无法使用 numba 的磁盘缓存
+    @njit(cache=not getattr(sys, 'frozen', False), fastmath=True)
+    def _snr_kernel(x, frame_size):
+        """单次遍历同时累加全局平方和与每帧 RMS"""
+        n_frames = len(x) // frame_size
+        frame_rms = np.empty(n_frames, dtype=np.float32)
+        total = 0.0
+        for i in range(n_frames):
+            frame_sum = 0.0
+            for j in range(i * frame_size, (i + 1) * frame_size):
+                v = x[j]
+                frame_sum += v * v
+            frame_rms[i] = np.sqrt(frame_sum / frame_size)
+            total += frame_sum
+        return total, frame_rms
+
+def frame_power(audio_data):
+    """返回完整帧的平方和及每帧 RMS（丢弃末尾不足一帧的样本）"""
+    if njit is not None:
+        return _snr_kernel(np.ascontiguousarray(audio_data), FRAME_SIZE)
+    
+    n = (len(audio_data) // FRAME_SIZE) * FRAME_SIZE
+    frames = audio_data[:n].reshape(-1, FRAME_SIZE)
+    sq = frames * frames
+    return float(sq.sum()), np.sqrt(sq.mean(axis=1))
+
+def snr_from_power(signal_rms, frame_rms):
+    """由信号均方值和每帧 RMS 计算 SNR"""
+    if frame_rms.size == 0:
+        raise ValueError("音频过短，无法计算SNR")
     
     # 估计噪声（假设最安静的 10% 的帧为噪声）
-    frame_size = 2048
-    frames = np.array_split(audio_data, len(audio_data) // frame_size)
-    frame_rms = np.array([np.sqrt(np.mean(np.square(frame))) for frame in frames])
-    noise_rms = np.mean(np.square(np.percentile(frame_rms, 10)))
+    k = frame_rms.size // 10
+    noise_frame_rms = np.partition(frame_rms, k)[k]
+    noise_rms = noise_frame_rms * noise_frame_rms
     
     # 避免除以零
     if noise_rms == 0:
@@ -24,7 +68,34 @@ def calculate_snr(audio_data):
     snr_db = 10 * np.log10(signal_rms / noise_rms)
     return round(snr_db, 2)
 
-def get_audio_info(file_path):
+def calculate_snr(audio_data):
+    """计算音频数据的信噪比"""
+    sq_sum, frame_rms = frame_power(audio_data)
+    # 计算信号的均方值
+    signal_rms = sq_sum / max(frame_rms.size * FRAME_SIZE, 1)
+    return snr_from_power(signal_rms, frame_rms)
+
+def calculate_file_snr(file_path):
+    """分块流式读取音频文件开头部分并计算信噪比，内存占用与文件长度无关"""
+    with sf.SoundFile(file_path) as snd:
+        total_samples = min(snd.frames, snd.samplerate * SNR_MAX_SECONDS)
+        frame_rms = np.empty(total_samples // FRAME_SIZE, dtype=np.float32)
+        sq_sum = 0.0
+        n_frames = 0
+        for block in snd.blocks(blocksize=FRAME_SIZE * BLOCK_FRAMES, frames=total_samples,
+                                dtype='float32', always_2d=True):
+            # 转换为单声道；帧数以文件头为准，防止实际读出的数据多于预期
+            mono = block.mean(axis=1, dtype=np.float32)
+            block_sum, block_rms = frame_power(mono[:(frame_rms.size - n_frames) * FRAME_SIZE])
+            frame_rms[n_frames:n_frames + block_rms.size] = block_rms
+            sq_sum += block_sum
+            n_frames += block_rms.size
+    
+    # 计算信号的均方值
+    signal_rms = sq_sum / max(n_frames * FRAME_SIZE, 1)
+    return snr_from_power(signal_rms, frame_rms[:n_frames])
+
+def get_audio_info(file_path, compute_snr=True):
     try:
         # 使用mutagen读取音频文件
         audio = File(file_path)
@@ -33,18 +104,17 @@ def get_audio_info(file_path):
             print(f"不支持的文件格式: {file_path}")
             return None
             
-        # 使用soundfile读取音频数据计算SNR
-        try:
-            audio_data, sr = sf.read(file_path)
-            # 如果是立体声，转换为单声道
-            if len(audio_data.shape) > 1:
-                audio_data = np.mean(audio_data, axis=1)
-            snr = calculate_snr(audio_data)
-        except Exception as e:
-            print(f"计算SNR时出错: {str(e)}")
-            snr = 0
+        # 使用soundfile读取音频数据计算SNR（不需要时跳过解码）
+        snr = None
+        if compute_snr:
+            try:
+                # 分块流式读取（float32），避免长音频整体载入内存
+                snr = calculate_file_snr(file_path)
+            except Exception as e:
+                print(f"计算SNR时出错: {str(e)}")
+                snr = 0
             
-        print(snr)
+            print(snr)
         # 获取基本信息
         duration = audio.info.length  # 时长（秒）
         
@@ -68,10 +138,14 @@ def get_audio_info(file_path):
         print(f"处理文件 {file_path} 时出错: {str(e)}")
         return None
 
-# main函数保持不变
 def main():
+    parser = argparse.ArgumentParser(description="统计目录下音频文件的时长、码率、信噪比和采样精度")
+    parser.add_argument("directory", nargs="?", help="要分析的目录路径（省略时交互输入）")
+    parser.add_argument("--no-snr", action="store_true", help="不计算信噪比，只读取元数据")
+    args = parser.parse_args()
+    
     # 获取用户输入的目录
-    directory = input("请输入要分析的目录路径: ").strip()
+    directory = args.directory or input("请输入要分析的目录路径: ").strip()
     
     # 检查目录是否存在
     if not os.path.exists(directory):
@@ -90,19 +164,26 @@ def main():
         # 写入表头
         f.write("文件路径&&时长(秒)&&码率(bps)&&信噪比(dB)&&采样精度(bit)\n")
         
-        # 遍历目录
+        # 遍历目录，收集待分析的文件
+        file_paths = []
         for root, dirs, files in os.walk(directory):
             for file in files:
                 if file.lower().endswith(audio_extensions):
-                    file_path = os.path.join(root, file)
-                    info = get_audio_info(file_path)
-                    
-                    if info:
-                        # 写入文件信息
-                        line = f"{info['path']}&&{info['duration']}&&{info['bitrate']}&&{info['snr']}&&{info['sample_width']}\n"
-                        f.write(line)
+                    file_paths.append(os.path.join(root, file))
+        
+        # 各文件相互独立，用多进程并行分析（结果按收集顺序返回）
+        analyze = functools.partial(get_audio_info, compute_snr=not args.no_snr)
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for info in executor.map(analyze, file_paths, chunksize=8):
+                if info:
+                    # 写入文件信息（未计算信噪比时留空）
+                    snr = '' if info['snr'] is None else info['snr']
+                    line = f"{info['path']}&&{info['duration']}&&{info['bitrate']}&&{snr}&&{info['sample_width']}\n"
+                    f.write(line)
     
     print(f"分析完成！结果已保存到: {output_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # PyInstaller 打包后在 Windows 上使用多进程需要此调用
+    multiprocessing.freeze_support()
+    main()
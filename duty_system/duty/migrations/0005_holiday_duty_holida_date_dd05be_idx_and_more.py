@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-15 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('duty', '0004_dutyswaprequest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='holiday',
+            index=models.Index(fields=['date'], name='duty_holida_date_dd05be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shiftchangerequest',
+            index=models.Index(fields=['date'], name='duty_shiftc_date_f7879b_idx'),
+        ),
+    ]
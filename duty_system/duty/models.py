@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Staff(models.Model):
@@ -10,6 +11,9 @@ class Holiday(models.Model):
     description = models.CharField(max_length=100)
     # ... 其他字段
 
+    class Meta:
+        indexes = [models.Index(fields=['date'])]
+
 class DutySchedule(models.Model):
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE)
     date = models.DateField()
@@ -17,6 +21,7 @@ class DutySchedule(models.Model):
     
     class Meta:
         ordering = ['date']
+        # 联合唯一索引以 date 开头，已可用于按日期过滤，无需单独建索引
         unique_together = ['date', 'staff']
 
     def __str__(self):
@@ -27,6 +32,9 @@ class ShiftChangeRequest(models.Model):
     date = models.DateField()
     # ... 其他字段
 
+    class Meta:
+        indexes = [models.Index(fields=['date'])]
+
 class DutyOrder(models.Model):
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE)
     order = models.IntegerField()  # 排序号
@@ -62,18 +70,29 @@ class DutySwapRequest(models.Model):
 
     def accept(self):
         if self.status == 'pending':
-            # 交换值班安排
-            requester_staff = self.requester_duty.staff
-            target_staff = self.target_duty.staff
-            
-            self.requester_duty.staff = target_staff
-            self.target_duty.staff = requester_staff
-            
-            self.requester_duty.save()
-            self.target_duty.save()
+            with transaction.atomic():
+                # 仅当申请仍为待处理时才标记为已接受，防止并发重复处理
+                updated = DutySwapRequest.objects.filter(pk=self.pk, status='pending').update(
+                    status='accepted',
+                    updated_at=timezone.now()
+                )
+                if not updated:
+                    return
+                
+                # 锁定两条排班后交换值班人员
+                staff_ids = dict(
+                    DutySchedule.objects.select_for_update()
+                    .filter(pk__in=[self.requester_duty_id, self.target_duty_id])
+                    .values_list('pk', 'staff_id')
+                )
+                DutySchedule.objects.filter(pk=self.requester_duty_id).update(
+                    staff_id=staff_ids[self.target_duty_id]
+                )
+                DutySchedule.objects.filter(pk=self.target_duty_id).update(
+                    staff_id=staff_ids[self.requester_duty_id]
+                )
             
             self.status = 'accepted'
-            self.save()
 
     def reject(self):
         if self.status == 'pending':
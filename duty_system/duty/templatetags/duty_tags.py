@@ -1,5 +1,5 @@
 from django import template
-from datetime import date, datetime
+from datetime import date
 
 register = template.Library()
 
@@ -10,20 +10,15 @@ def is_user_duty(duty_info, user):
 
 @register.filter
 def format_date(year, month, day):
-    """格式化日期为 YYYY-MM-DD 格式"""
-    try:
-        return f"{year}-{month:02d}-{int(day):02d}"
-    except (ValueError, TypeError):
-        return ""
+    """格式化日期为 YYYY-MM-DD 格式（参数为 monthcalendar 给出的整数，0 表示空白格）"""
+    return "%04d-%02d-%02d" % (year, month, day) if day else ""
 
 @register.filter
-def is_future_or_today(date_str):
-    """检查日期是否是今天或将来"""
-    try:
-        check_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        return check_date >= date.today()
-    except (ValueError, TypeError):
+def is_future_or_today(check_date, today=None):
+    """检查日期是否是今天或将来（today 可由视图传入，避免每格重复获取）"""
+    if not isinstance(check_date, date):
         return False
+    return check_date >= (today or date.today())
 
 @register.filter
 def get_item(dictionary, key):
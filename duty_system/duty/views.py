@@ -9,6 +9,7 @@ from datetime import datetime, date, timedelta
 import csv
 import logging
 from .models import Staff, Holiday, DutySchedule, DutyOrder, User, DutySwapRequest
+from django.db import transaction
 from django.db.models import Max
 from django.contrib.auth.models import User
 from openpyxl import Workbook
@@ -38,11 +39,15 @@ def duty_calendar(request):
     # 获取月历
     cal = monthcalendar(year, month)
     
-    # 获取当月所有排班和节假日
+    # 预先构造每个日期格对应的日期对象，模板中直接与今天比较
+    today = date.today()
+    cell_dates = {day: date(year, month, day) for week in cal for day in week if day}
+    
+    # 获取当月所有排班和节假日（直接取元组，不实例化模型）
     schedules = DutySchedule.objects.filter(
         date__year=year,
         date__month=month
-    ).select_related('staff__user')
+    ).values_list('date__day', 'staff__user__username', 'is_holiday')
     
     holidays = Holiday.objects.filter(
         date__year=year,
@@ -50,24 +55,19 @@ def duty_calendar(request):
     ).values_list('date__day', flat=True)
     
     # 转换为字典格式
-    schedule_dict = {
-        schedule.date.day: (schedule.staff.user.username, schedule.is_holiday)
-        for schedule in schedules
-    }
+    schedule_dict = {day: (username, is_holiday) for day, username, is_holiday in schedules}
     
     # 获取当前用户收到的待处理换班申请
     pending_swaps = []
     if request.user.is_authenticated:
-        staff = Staff.objects.filter(user=request.user).first()
-        if staff:
-            pending_swaps = DutySwapRequest.objects.filter(
-                target__user=request.user,
-                status='pending'
-            ).select_related(
-                'requester__user',
-                'requester_duty',
-                'target_duty'
-            )
+        pending_swaps = DutySwapRequest.objects.filter(
+            target__user=request.user,
+            status='pending'
+        ).select_related(
+            'requester__user',
+            'requester_duty',
+            'target_duty'
+        )
     
     context = {
         'calendar': cal,
@@ -76,7 +76,8 @@ def duty_calendar(request):
         'holidays': list(holidays),
         'is_admin': request.user.is_staff,
         'pending_swaps': pending_swaps,
-        'today': date.today().strftime('%Y-%m-%d'),  # 格式化今天的日期为字符串
+        'cell_dates': cell_dates,
+        'today': today,
     }
     
     return render(request, 'duty/calendar.html', context)
@@ -92,14 +93,14 @@ def toggle_holiday(request):
         
         date_obj = date(year, month, day)
         
-        # 更新或创建节假日记录
-        holiday, created = Holiday.objects.get_or_create(
-            date=date_obj,
-            defaults={'description': '手动设置'}
-        )
-        
-        if not is_holiday:
-            holiday.delete()
+        # 设为节假日时创建记录，取消时直接删除，避免先插入再删除
+        if is_holiday:
+            Holiday.objects.get_or_create(
+                date=date_obj,
+                defaults={'description': '手动设置'}
+            )
+        else:
+            Holiday.objects.filter(date=date_obj).delete()
         
         return JsonResponse({'status': 'success'})
     except Exception as e:
@@ -126,12 +127,16 @@ def regenerate_schedule(request):
         workday_index = 0
         holiday_index = 0
         
-        # 清除已存在的当月排班
-        DutySchedule.objects.filter(date__year=year, date__month=month).delete()
+        # 一次性取出当月节假日，避免逐日查询
+        holiday_set = set(Holiday.objects.filter(
+            date__gte=start_date,
+            date__lt=end_date
+        ).values_list('date', flat=True))
         
+        to_create = []
         current_date = start_date
         while current_date < end_date:
-            is_holiday = Holiday.objects.filter(date=current_date).exists()
+            is_holiday = current_date in holiday_set
             is_weekend = current_date.weekday() >= 5
             
             should_schedule = False
@@ -143,12 +148,11 @@ def regenerate_schedule(request):
                 should_schedule = True
             
             if should_schedule:
-                staff = duty_orders[current_index].staff
-                DutySchedule.objects.create(
-                    staff=staff,
+                to_create.append(DutySchedule(
+                    staff_id=duty_orders[current_index].staff_id,
                     date=current_date,
                     is_holiday=(is_holiday or is_weekend)
-                )
+                ))
                 
                 if is_holiday or is_weekend:
                     holiday_index = (holiday_index + 1) % len(duty_orders)
@@ -157,14 +161,21 @@ def regenerate_schedule(request):
             
             current_date += timedelta(days=1)
         
+        # 清除已存在的当月排班并批量写入新排班
+        with transaction.atomic():
+            DutySchedule.objects.filter(date__year=year, date__month=month).delete()
+            DutySchedule.objects.bulk_create(to_create, batch_size=500)
+        
         return JsonResponse({'status': 'success'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
 @login_required
 def duty_list(request):
+    now = datetime.now()
     schedules = DutySchedule.objects.filter(
-        date__month=datetime.now().month
+        date__year=now.year,
+        date__month=now.month
     ).select_related('staff__user').order_by('date')
     
     return render(request, 'duty/duty_list.html', {
@@ -174,13 +185,10 @@ def duty_list(request):
 @login_required
 def export_schedule(request):
     try:
-        # 获取用户指定的年月
-        if request.method == 'POST':
-            year = int(request.POST.get('year'))
-            month = int(request.POST.get('month'))
-        else:
-            year = datetime.now().year
-            month = datetime.now().month
+        # 获取用户指定的年月，未指定时使用当前年月
+        now = datetime.now()
+        year = int(request.POST.get('year') or now.year)
+        month = int(request.POST.get('month') or now.month)
 
         # 创建工作簿和工作表
         wb = Workbook()
@@ -210,11 +218,35 @@ def export_schedule(request):
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        header_font = Font(bold=True)
+        header_alignment = Alignment(horizontal='center', vertical='center')
+        alignment_center = Alignment(horizontal='center', vertical='center', wrap_text=True)
+        
+        # 日历单元格样式只创建一次并注册到工作簿，循环内按名称引用
+        wb.add_named_style(NamedStyle(
+            name='holiday',
+            font=Font(color='FF0000'),  # 红色字体
+            fill=holiday_fill,
+            border=border,
+            alignment=alignment_center
+        ))
+        wb.add_named_style(NamedStyle(
+            name='workday',
+            font=Font(color='000000'),  # 黑色字体
+            fill=workday_fill,
+            border=border,
+            alignment=alignment_center
+        ))
+        wb.add_named_style(NamedStyle(
+            name='blank',
+            border=border,
+            alignment=alignment_center
+        ))
         
         for col, weekday in enumerate(weekdays, 1):
             cell = ws.cell(row=2, column=col, value=weekday)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.font = header_font
+            cell.alignment = header_alignment
             cell.border = border
             if col > 5:  # 周六和周日
                 cell.fill = weekend_fill
@@ -224,62 +256,42 @@ def export_schedule(request):
         # 获取月历数据
         cal = monthcalendar(year, month)
         
-        # 获取当月所有排班
+        # 获取当月所有排班（直接取元组，不实例化模型）
         schedules = DutySchedule.objects.filter(
             date__year=year,
             date__month=month
-        ).select_related('staff__user')
+        ).values_list('date__day', 'staff__user__username', 'is_holiday')
         
-        # 转换为字典格式，包含值班人员和是否节假日的信息
-        schedule_dict = {
-            schedule.date.day: {
-                'staff': schedule.staff.user.username,
-                'is_holiday': schedule.is_holiday
-            }
-            for schedule in schedules
-        }
+        # 按日期号索引的定长列表（下标 1-31），循环内直接按下标取值
+        staff_by_day = [''] * 32
+        is_holiday_by_day = [False] * 32
+        for day, username, is_holiday in schedules:
+            staff_by_day[day] = username
+            is_holiday_by_day[day] = is_holiday
         
-        # 获取节假日数据
-        holidays = set(Holiday.objects.filter(
+        # 节假日数据并入同一列表
+        for day in Holiday.objects.filter(
             date__year=year,
             date__month=month
-        ).values_list('date__day', flat=True))
+        ).values_list('date__day', flat=True):
+            is_holiday_by_day[day] = True
+        
+        # 预先生成所有日期格的内容和样式（每周固定 7 列，col > 5 为周末）
+        cell_values = [
+            None if day == 0 else (f"{day}\n{staff_by_day[day]}" if staff_by_day[day] else str(day))
+            for week in cal for day in week
+        ]
+        cell_styles = [
+            'blank' if day == 0 else ('holiday' if is_holiday_by_day[day] or col > 5 else 'workday')
+            for week in cal for col, day in enumerate(week, 1)
+        ]
         
         # 填充日历数据
-        current_row = 3
-        for week in cal:
-            row_height = 60  # 设置行高
-            ws.row_dimensions[current_row].height = row_height
-            
-            for col, day in enumerate(week, 1):
-                cell = ws.cell(row=current_row, column=col)
-                cell.border = border
-                cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                
-                if day != 0:
-                    # 获取当天的排班信息
-                    schedule_info = schedule_dict.get(day, {})
-                    is_weekend = col > 5
-                    is_holiday = day in holidays
-                    
-                    # 设置日期和值班人员
-                    date_text = str(day)
-                    duty_staff = schedule_info.get('staff', '')
-                    
-                    if duty_staff:
-                        cell.value = f"{date_text}\n{duty_staff}"
-                    else:
-                        cell.value = date_text
-                    
-                    # 根据实际排班状态设置样式
-                    if schedule_info.get('is_holiday', False) or is_holiday or is_weekend:
-                        cell.font = Font(color='FF0000')  # 红色字体
-                        cell.fill = holiday_fill
-                    else:
-                        cell.font = Font(color='000000')  # 黑色字体
-                        cell.fill = workday_fill
-            
-            current_row += 1
+        for row in range(3, 3 + len(cal)):
+            ws.row_dimensions[row].height = 60  # 设置行高
+        for i, (value, style) in enumerate(zip(cell_values, cell_styles)):
+            cell = ws.cell(row=3 + i // 7, column=i % 7 + 1, value=value)
+            cell.style = style
         
         # 设置响应头
         response = HttpResponse(
@@ -324,16 +336,14 @@ def manage_duty_order(request):
         except Exception as e:
             messages.error(request, f'操作失败：{str(e)}')
     
-    # 获取所有用户和值班顺序
-    all_users = User.objects.exclude(is_superuser=True).all()
+    # 获取值班顺序
     duty_orders = DutyOrder.objects.select_related('staff__user').filter(is_active=True)
     inactive_orders = DutyOrder.objects.select_related('staff__user').filter(is_active=False)
     
-    # 获取已经在值班顺序中的用户ID列表
-    users_in_order = set(DutyOrder.objects.values_list('staff__user_id', flat=True))
-    
-    # 过滤出未在值班顺序中的用户
-    available_users = [user for user in all_users if user.id not in users_in_order]
+    # 在数据库中过滤出未在值班顺序中的用户
+    available_users = User.objects.exclude(is_superuser=True).exclude(
+        id__in=DutyOrder.objects.values('staff__user_id')
+    )
     
     return render(request, 'duty/manage_duty_order.html', {
         'available_users': available_users,
@@ -363,12 +373,16 @@ def generate_monthly_schedule(request):
         workday_index = 0
         holiday_index = 0
         
-        # 清除已存在的当月排班
-        DutySchedule.objects.filter(date__year=year, date__month=month).delete()
+        # 一次性取出当月节假日，避免逐日查询
+        holiday_set = set(Holiday.objects.filter(
+            date__gte=start_date,
+            date__lt=end_date
+        ).values_list('date', flat=True))
         
+        to_create = []
         current_date = start_date
         while current_date < end_date:
-            is_holiday = Holiday.objects.filter(date=current_date).exists()
+            is_holiday = current_date in holiday_set
             is_weekend = current_date.weekday() >= 5
             
             should_schedule = False
@@ -380,12 +394,11 @@ def generate_monthly_schedule(request):
                 should_schedule = True
             
             if should_schedule:
-                staff = duty_orders[current_index].staff
-                DutySchedule.objects.create(
-                    staff=staff,
+                to_create.append(DutySchedule(
+                    staff_id=duty_orders[current_index].staff_id,
                     date=current_date,
                     is_holiday=(is_holiday or is_weekend)
-                )
+                ))
                 
                 if is_holiday or is_weekend:
                     holiday_index = (holiday_index + 1) % len(duty_orders)
@@ -394,6 +407,11 @@ def generate_monthly_schedule(request):
             
             current_date += timedelta(days=1)
         
+        # 清除已存在的当月排班并批量写入新排班
+        with transaction.atomic():
+            DutySchedule.objects.filter(date__year=year, date__month=month).delete()
+            DutySchedule.objects.bulk_create(to_create, batch_size=500)
+        
         messages.success(request, f'已成功生成 {year}年{month}月的值班表')
         return redirect('duty_calendar')
         
@@ -411,12 +429,9 @@ def get_available_swaps(request):
     if current_date < date.today():
         return JsonResponse({'error': '不能交换过去的值班'}, status=400)
     
-    # 获取当前用户的值班安排
-    current_staff = Staff.objects.get(user=request.user)
-    current_duty = DutySchedule.objects.get(
-        staff=current_staff,
-        date=current_date
-    )
+    # 确认当前用户当天确有值班安排
+    if not DutySchedule.objects.filter(staff__user=request.user, date=current_date).exists():
+        return JsonResponse({'error': '您当天没有值班安排'}, status=400)
     
     # 获取可换班的值班安排（当天及以后的，不包括自己的）
     available_duties = DutySchedule.objects.filter(
@@ -424,13 +439,13 @@ def get_available_swaps(request):
         date__year=year,
         date__month=month
     ).exclude(
-        staff=current_staff
-    ).select_related('staff__user')
+        staff__user=request.user
+    ).values('id', 'staff__user__username', 'date')
     
     duties_data = [{
-        'id': duty.id,
-        'staff_name': duty.staff.user.username,
-        'date': duty.date.strftime('%Y年%m月%d日'),
+        'id': duty['id'],
+        'staff_name': duty['staff__user__username'],
+        'date': duty['date'].strftime('%Y年%m月%d日'),
     } for duty in available_duties]
     
     return JsonResponse(duties_data, safe=False)
@@ -1,13 +1,42 @@
 import os
 import sys
 import re
+import hashlib
+import sqlite3
+import threading
 import traceback
-from typing import List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, TextIO, Tuple
 from email import policy
 from email.header import decode_header, make_header
 from email.parser import BytesParser
 
-from bs4 import BeautifulSoup
+# HTML 解析：优先使用 selectolax（直接绑定 C 实现的 HTML 解析器，纯文本抽取最快）；
+# 未安装时退回 BeautifulSoup
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # BeautifulSoup 的解析器：优先使用 C 实现的 lxml，未安装时退回纯 Python 的 html.parser
+    try:
+        import lxml  # noqa: F401
+        HTML_PARSER = "lxml"
+    except ImportError:
+        HTML_PARSER = "html.parser"
+
+    # 只构建 <body> 子树，<head> 中的 title/meta/link/script/style 不生成对象
+    BODY_STRAINER = SoupStrainer("body")
+
+# 预编译的正则：行尾空白、多余空行、段落分隔
+TRAILING_SPACES_RE = re.compile(r"[ \t]+\n")
+MULTI_BLANK_RE = re.compile(r"\n{3,}")
+PARA_SPLIT_RE = re.compile(r"\n{2,}")
+# 中文判定：CJK 统一表意文字、非空白字符
+CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+NON_SPACE_RE = re.compile(r"\S")
 
 # ====== 配置：选择翻译实现 ======
 # True 使用 Google Cloud Translation (官方)；False 使用 googletrans（非官方）
@@ -19,11 +48,30 @@ TARGET_LANG = "zh-CN"
 # 每段翻译最大字符数，避免超限（Google 官方单次请求最大 30K 字节左右，这里保守一些）
 MAX_CHARS_PER_CHUNK = 4000
 
+# 批量翻译时单次请求的总字符数上限（按 UTF-8 最多 3 字节/字符估算，约 30K 字节）
+MAX_CHARS_PER_REQUEST = 10000
+# 单次请求的文本条数上限（v3 API 限制为 1024）
+MAX_CONTENTS_PER_REQUEST = 1024
+
+# 译文缓存（翻译记忆）文件；设为 None 则只在进程内缓存
+TRANSLATION_CACHE_PATH: Optional[str] = os.path.expanduser("~/.eml_trans_cache.db")
+# 进程内缓存的条目数
+TRANSLATION_MEMO_SIZE = 4096
+
+# 并发处理 .eml 的线程数（耗时主要在等待翻译 API 的网络往返）
+MAX_WORKERS = 16
+
 
 def safe_str(s: Optional[str]) -> str:
     return s if isinstance(s, str) else (s.decode("utf-8", "ignore") if isinstance(s, bytes) else "")
 
 
+def is_mostly_chinese(s: str) -> bool:
+    """非空白字符中 CJK 汉字占一半以上时视为已是中文。"""
+    visible = len(NON_SPACE_RE.findall(s))
+    return visible > 0 and len(CJK_RE.findall(s)) >= 0.5 * visible
+
+
 def decode_mime_header(value: Optional[str]) -> str:
     """解码 RFC 2047/2231 头部（如 Subject、文件名等），并返回 str。"""
     if value is None:
@@ -47,55 +95,65 @@ def decode_mime_header(value: Optional[str]) -> str:
 
 def extract_text_from_html(html: str) -> str:
     """将 HTML 正文抽取为纯文本。"""
-    soup = BeautifulSoup(html, "html.parser")
-    # 去除脚本和样式
-    for tag in soup(["script", "style"]):
-        tag.decompose()
-    text = soup.get_text(separator="\n")
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        # 去除脚本和样式
+        for node in tree.css("script, style"):
+            node.decompose()
+        root = tree.body if tree.body is not None else tree.root
+        text = root.text(separator="\n") if root is not None else ""
+    else:
+        soup = BeautifulSoup(html, HTML_PARSER, parse_only=BODY_STRAINER)
+        if soup.body is None:
+            # 没有 <body> 的 HTML 片段（html.parser 不会自动补全）整体解析
+            soup = BeautifulSoup(html, HTML_PARSER)
+        # 去除 body 内嵌的脚本和样式
+        for tag in soup(["script", "style"]):
+            tag.decompose()
+        text = soup.get_text(separator="\n")
     # 规范空白
-    text = re.sub(r"[ \t]+\n", "\n", text)
-    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    text = TRAILING_SPACES_RE.sub("\n", text)
+    text = MULTI_BLANK_RE.sub("\n\n", text).strip()
     return text
 
 
-def get_email_body(msg) -> str:
-    """优先取 text/plain；若没有则从 text/html 提取纯文本；多段合并。"""
+def scan_email(msg) -> Tuple[str, List[str]]:
+    """单次遍历 MIME 树，同时取得正文和附件文件名。
+
+    正文优先取 text/plain；若没有则从 text/html 提取纯文本；多段合并。
+    """
     plain_parts: List[str] = []
     html_parts: List[str] = []
+    attach_names: List[str] = []
+    is_multipart = msg.is_multipart()
 
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            dispo = (part.get_content_disposition() or "").lower()
-            if dispo == "attachment":
-                continue  # 附件不当正文
-            try:
-                payload = part.get_payload(decode=True)
-                if payload is None:
-                    continue
-                charset = part.get_content_charset() or "utf-8"
-                text = payload.decode(charset, errors="replace")
-            except Exception:
-                continue
+    # 非 multipart 时 walk() 只产出 msg 本身
+    for part in msg.walk():
+        dispo = (part.get_content_disposition() or "").lower()
+        filename = part.get_filename()
+        if dispo == "attachment" or filename:
+            fname = decode_mime_header(filename)
+            if fname:
+                attach_names.append(fname)
+        if is_multipart and dispo == "attachment":
+            continue  # 附件不当正文
 
-            if ctype == "text/plain":
-                plain_parts.append(text)
-            elif ctype == "text/html":
-                html_parts.append(text)
-    else:
-        # 非 multipart
-        ctype = msg.get_content_type()
+        ctype = part.get_content_type()
+        if ctype not in ("text/plain", "text/html"):
+            continue  # 非文本部分无需解码
         try:
-            payload = msg.get_payload(decode=True)
-            if payload is not None:
-                charset = msg.get_content_charset() or "utf-8"
-                text = payload.decode(charset, errors="replace")
-                if ctype == "text/plain":
-                    plain_parts.append(text)
-                elif ctype == "text/html":
-                    html_parts.append(text)
+            payload = part.get_payload(decode=True)
+            if payload is None:
+                continue
+            charset = part.get_content_charset() or "utf-8"
+            text = payload.decode(charset, errors="replace")
         except Exception:
-            pass
+            continue
+
+        if ctype == "text/plain":
+            plain_parts.append(text)
+        else:
+            html_parts.append(text)
 
     body = "\n\n".join(p.strip() for p in plain_parts if p and p.strip())
     if not body and html_parts:
@@ -103,21 +161,74 @@ def get_email_body(msg) -> str:
         html_texts = [extract_text_from_html(h) for h in html_parts]
         body = "\n\n".join(t for t in html_texts if t and t.strip())
 
-    return body.strip()
+    return body.strip(), attach_names
+
+
+def get_email_body(msg) -> str:
+    """优先取 text/plain；若没有则从 text/html 提取纯文本；多段合并。"""
+    return scan_email(msg)[0]
 
 
 def get_attachments_names(msg) -> List[str]:
-    names = []
-    for part in msg.walk():
-        dispo = (part.get_content_disposition() or "").lower()
-        if dispo == "attachment" or part.get_filename():
-            fname = decode_mime_header(part.get_filename())
-            if fname:
-                names.append(fname)
-    return names
+    return scan_email(msg)[1]
 
 
 # ====== 翻译实现 ======
+class TranslationCache:
+    """译文缓存：键为 blake2b(目标语言 + 原文)，进程内 LRU 在前，磁盘 sqlite 在后。
+
+    会被多个工作线程共用，所有读写都在锁内进行。
+    """
+
+    def __init__(self, target_lang: str, path: Optional[str] = TRANSLATION_CACHE_PATH,
+                 memo_size: int = TRANSLATION_MEMO_SIZE):
+        self.target_lang = target_lang
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b((self.target_lang + "\0" + text).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _remember(self, key: str, translated: str) -> None:
+        self._memo[key] = translated
+        self._memo.move_to_end(key)
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def get(self, text: str) -> Optional[str]:
+        key = self._key(text)
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Optional[str]:
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT text FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._remember(key, row[0])
+        return row[0]
+
+    def put_many(self, pairs: Dict[str, str]) -> None:
+        """批量写入 {原文: 译文}。"""
+        rows = [(self._key(src), dst) for src, dst in pairs.items()]
+        with self._lock:
+            for key, dst in rows:
+                self._remember(key, dst)
+            if self._db is not None and rows:
+                self._db.executemany("INSERT OR REPLACE INTO translations (key, text) VALUES (?, ?)", rows)
+                self._db.commit()
+
+
 class Translator:
     def __init__(self, target_lang: str):
         self.target_lang = target_lang
@@ -133,6 +244,7 @@ class Translator:
         else:
             from googletrans import Translator as GT
             self.client = GT()
+        self.cache = TranslationCache(target_lang)
 
     def _detect_project_id(self) -> str:
         # 优先从凭据里读；若失败可让用户手动填
@@ -150,33 +262,81 @@ class Translator:
         return "<YOUR_PROJECT_ID>"
 
     def translate_text(self, text: str) -> str:
-        text = text or ""
-        text = text.strip()
-        if not text:
-            return ""
-
-        # 分片，尽量按段落切，避免句子被截断
-        chunks = self._split_text(text, MAX_CHARS_PER_CHUNK)
+        return self.translate_texts([text])[0]
+
+    def translate_texts(self, texts: List[str]) -> List[str]:
+        """批量翻译多条文本，尽量合并到同一请求中，结果与输入一一对应。"""
+        # 分片，尽量按段落切，避免句子被截断；记录每个分片属于哪条文本
+        chunks: List[str] = []
+        owners: List[int] = []
+        for i, text in enumerate(texts):
+            text = (text or "").strip()
+            if not text:
+                continue
+            for ch in self._split_text(text, MAX_CHARS_PER_CHUNK):
+                chunks.append(ch)
+                owners.append(i)
+
+        # 先查缓存，只把未命中的分片（去重后）发给翻译 API
+        results: Dict[str, str] = {}
+        missing: List[str] = []
+        for ch in chunks:
+            if ch in results:
+                continue
+            hit = self.cache.get(ch)
+            if hit is None:
+                results[ch] = ""
+                missing.append(ch)
+            else:
+                results[ch] = hit
+        if missing:
+            fresh = dict(zip(missing, self._translate_chunks(missing)))
+            results.update(fresh)
+            # 空译文（如批量接口少返回的条目补成的 ""）不写入缓存，下次重新翻译
+            self.cache.put_many({src: dst for src, dst in fresh.items() if dst})
+
+        translated: List[List[str]] = [[] for _ in texts]
+        for i, ch in zip(owners, chunks):
+            translated[i].append(results[ch])
+        return ["\n".join(outs).strip() for outs in translated]
+
+    def _translate_chunks(self, chunks: List[str]) -> List[str]:
+        if not chunks:
+            return []
         if USE_GOOGLE_CLOUD:
-            translated_chunks = []
-            for ch in chunks:
-                # v3 API
+            outs: List[str] = []
+            for batch in self._batch_chunks(chunks):
+                # v3 API，一次请求携带多条 contents
                 resp = self.client.translate_text(
                     request={
                         "parent": self.parent,
-                        "contents": [ch],
+                        "contents": batch,
                         "mime_type": "text/plain",
                         "target_language_code": self.target_lang,
                     }
                 )
-                translated_chunks.append(resp.translations[0].translated_text if resp.translations else "")
-            return "\n".join(translated_chunks).strip()
+                results = [t.translated_text for t in resp.translations]
+                outs.extend(results + [""] * (len(batch) - len(results)))
+            return outs
         else:
             # googletrans 支持批量，但为稳妥逐段
-            outs = []
-            for ch in chunks:
-                outs.append(self.client.translate(ch, dest=self.target_lang).text)
-            return "\n".join(outs).strip()
+            return [self.client.translate(ch, dest=self.target_lang).text for ch in chunks]
+
+    @staticmethod
+    def _batch_chunks(chunks: List[str]) -> List[List[str]]:
+        """按总字符数和条数上限把分片分组，每组对应一次请求。"""
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        size = 0
+        for ch in chunks:
+            if batch and (size + len(ch) > MAX_CHARS_PER_REQUEST or len(batch) >= MAX_CONTENTS_PER_REQUEST):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(ch)
+            size += len(ch)
+        if batch:
+            batches.append(batch)
+        return batches
 
     @staticmethod
     def _split_text(text: str, max_len: int) -> List[str]:
@@ -184,7 +344,7 @@ class Translator:
             return [text]
         parts = []
         # 先按双换行分段
-        paragraphs = re.split(r"\n{2,}", text)
+        paragraphs = PARA_SPLIT_RE.split(text)
         buf = ""
         for p in paragraphs:
             if not buf:
@@ -209,6 +369,7 @@ class Translator:
 
 
 def format_output(
+    fw: TextIO,
     eml_path: str,
     sender: str,
     recipients: str,
@@ -219,34 +380,34 @@ def format_output(
     body_cn: str,
     attach_raw: List[str],
     attach_cn: List[str],
-) -> str:
-    lines = []
-    lines.append(f"发件人: {sender}")
-    lines.append(f"收件人: {recipients}")
-    lines.append(f"时间: {date_str}")
-    lines.append("")
-    lines.append("邮件标题（原文）:")
-    lines.append(subject_raw or "")
-    lines.append("")
-    lines.append("邮件标题（中文）:")
-    lines.append(subject_cn or "")
-    lines.append("\n" + "=" * 60 + "\n")
-    lines.append("邮件正文（原文）:")
-    lines.append(body_raw or "")
-    lines.append("")
-    lines.append("邮件正文（中文）:")
-    lines.append(body_cn or "")
-    lines.append("\n" + "=" * 60 + "\n")
-    lines.append("邮件附件列表：")
+) -> None:
+    """按顺序把各部分直接写入 fw，不在内存中拼接整份输出。"""
+    sep = "\n" + "=" * 60 + "\n\n"
+    fw.write(f"发件人: {sender}\n")
+    fw.write(f"收件人: {recipients}\n")
+    fw.write(f"时间: {date_str}\n")
+    fw.write("\n")
+    fw.write("邮件标题（原文）:\n")
+    fw.write((subject_raw or "") + "\n")
+    fw.write("\n")
+    fw.write("邮件标题（中文）:\n")
+    fw.write((subject_cn or "") + "\n")
+    fw.write(sep)
+    fw.write("邮件正文（原文）:\n")
+    fw.write((body_raw or "") + "\n")
+    fw.write("\n")
+    fw.write("邮件正文（中文）:\n")
+    fw.write((body_cn or "") + "\n")
+    fw.write(sep)
+    fw.write("邮件附件列表：\n")
     if attach_raw:
         for i, name in enumerate(attach_raw):
             cn = attach_cn[i] if i < len(attach_cn) else ""
-            lines.append(f"- {name}  ——  {cn}")
+            fw.write(f"- {name}  ——  {cn}\n")
     else:
-        lines.append("- （无附件）")
-    lines.append("\n" + "=" * 60 + "\n")
-    lines.append(f"邮件原文件路径: {eml_path}")
-    return "\n".join(lines).rstrip() + "\n"
+        fw.write("- （无附件）\n")
+    fw.write(sep)
+    fw.write(f"邮件原文件路径: {eml_path}".rstrip() + "\n")
 
 
 def process_eml_file(eml_path: str, translator: Translator) -> Tuple[bool, Optional[str]]:
@@ -259,32 +420,35 @@ def process_eml_file(eml_path: str, translator: Translator) -> Tuple[bool, Optio
         date_str = safe_str(msg.get("Date"))
         subject_raw = decode_mime_header(msg.get("Subject"))
 
-        body_raw = get_email_body(msg)
-        attach_raw = get_attachments_names(msg)
-
-        # 翻译：主题、正文、附件
-        subject_cn = translator.translate_text(subject_raw) if subject_raw else ""
-        body_cn = translator.translate_text(body_raw) if body_raw else ""
-        attach_cn = [translator.translate_text(n) if n else "" for n in attach_raw]
-
-        out_text = format_output(
-            eml_path=eml_path,
-            sender=sender,
-            recipients=recipients,
-            date_str=date_str,
-            subject_raw=subject_raw,
-            subject_cn=subject_cn,
-            body_raw=body_raw,
-            body_cn=body_cn,
-            attach_raw=attach_raw,
-            attach_cn=attach_cn,
-        )
+        body_raw, attach_raw = scan_email(msg)
+
+        # 翻译：主题、正文、附件（合并为一次批量请求）
+        sources = [subject_raw, body_raw, *attach_raw]
+        translated = [(t or "").strip() for t in sources]
+        # 目标语言为中文时，已是中文的字段直接沿用原文，不再请求翻译
+        skip_chinese = translator.target_lang.lower().startswith("zh")
+        todo = [i for i, t in enumerate(sources) if t and not (skip_chinese and is_mostly_chinese(t))]
+        for i, out in zip(todo, translator.translate_texts([sources[i] for i in todo])):
+            translated[i] = out
+        subject_cn, body_cn, attach_cn = translated[0], translated[1], translated[2:]
 
         # 输出到同目录，同名 .txt
         base, _ = os.path.splitext(eml_path)
         out_path = base + ".txt"
-        with open(out_path, "w", encoding="utf-8") as fw:
-            fw.write(out_text)
+        with open(out_path, "w", encoding="utf-8", buffering=1 << 20) as fw:
+            format_output(
+                fw,
+                eml_path=eml_path,
+                sender=sender,
+                recipients=recipients,
+                date_str=date_str,
+                subject_raw=subject_raw,
+                subject_cn=subject_cn,
+                body_raw=body_raw,
+                body_cn=body_cn,
+                attach_raw=attach_raw,
+                attach_cn=attach_cn,
+            )
 
         return True, out_path
     except Exception as e:
@@ -293,22 +457,29 @@ def process_eml_file(eml_path: str, translator: Translator) -> Tuple[bool, Optio
 
 def walk_and_process(root_dir: str) -> None:
     translator = Translator(TARGET_LANG)
-    total = 0
     ok = 0
     errors: List[str] = []
 
-    for dirpath, _, filenames in os.walk(root_dir):
-        for name in filenames:
-            if name.lower().endswith(".eml"):
-                total += 1
-                eml_path = os.path.join(dirpath, name)
-                success, info = process_eml_file(eml_path, translator)
-                if success:
-                    ok += 1
-                    print(f"[OK] {eml_path} -> {info}")
-                else:
-                    errors.append(info)
-                    print(f"[ERR] {eml_path}")
+    eml_paths = [
+        os.path.join(dirpath, name)
+        for dirpath, _, filenames in os.walk(root_dir)
+        for name in filenames
+        if name.lower().endswith(".eml")
+    ]
+    total = len(eml_paths)
+
+    # 各文件相互独立，多线程并发处理；结果在主线程中汇总和打印
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_eml_file, p, translator): p for p in eml_paths}
+        for future in as_completed(futures):
+            eml_path = futures[future]
+            success, info = future.result()
+            if success:
+                ok += 1
+                print(f"[OK] {eml_path} -> {info}")
+            else:
+                errors.append(info)
+                print(f"[ERR] {eml_path}")
 
     print("\n=== 汇总 ===")
     print(f"总计 .eml: {total}")
@@ -2,11 +2,16 @@ import os
 import sys
 import json
 import math
+import mmap
+import re
 import time
 import argparse
 import hashlib
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 
 import numpy as np
 import faiss
@@ -20,79 +25,186 @@ CHAT_MODEL  = "gpt-4o-mini"              # 便宜快速，够用
 CHUNK_SIZE  = 1200                       # 每段最大字符（中文等宽估算）
 CHUNK_OVERLAP = 200                      # 块间重叠，保证语义连续
 EMBED_BATCH = 96                         # 嵌入批大小
+EMBED_WORKERS = 8                        # 并发嵌入请求数
+EMBED_MAX_RETRIES = 5                    # 触发限流时的最大重试次数（指数退避）
 TOP_K       = 6                          # 检索返回块数
 MAX_CONTEXT_CHARS = 12000                # 传给模型的总上下文字数上限
+HNSW_M      = 32                         # HNSW 图每个节点的邻居数
+HNSW_EF_CONSTRUCTION = 200               # 建图时的候选队列长度（越大图质量越高）
+HNSW_EF_SEARCH = 64                      # 检索时的候选队列长度（越大召回越高）
+IVFPQ_MIN_COUNT = 50000                  # 条目数达到此值时改用 IVFPQ 量化索引（训练需要足够样本）
+PQ_M        = 96                         # PQ 子向量个数（须整除维度），每条向量压缩为 96 字节
+PQ_NBITS    = 8                          # 每个子向量的编码位数
+IVF_NPROBE  = 16                         # IVF 检索时访问的聚类数
 # =================================
 
 # -------- OpenAI 官方 SDK（>=2024）--------
 try:
-    from openai import OpenAI
+    from openai import OpenAI, RateLimitError
 except Exception:
     # 旧版本包名为 openai；若用户装的是旧包，也尽量兼容
     raise SystemExit("请先安装 `pip install openai` (>=1.0)")
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def file_sha1(p: Path) -> str:
-    h = hashlib.sha1()
+# orjson 读写 JSON 更快（C 实现，直接输出 UTF-8 字节）；未安装时退回标准库
+try:
+    import orjson
+    json_loads = orjson.loads
+
+    def json_line(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    json_loads = json.loads
+
+    def json_line(obj) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+def file_digest(p: Path) -> str:
+    """文件指纹：BLAKE2b 比 SHA-1 快，整文件 mmap 后一次性送入，不经 Python 循环分块"""
+    h = hashlib.blake2b(digest_size=20)
     with open(p, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
+        if os.fstat(f.fileno()).st_size:  # 空文件无法 mmap
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
     return h.hexdigest()
 
 def normalize(v: np.ndarray) -> np.ndarray:
     # 余弦相似度：先单位化，FAISS 用内积即为 cos
-    norms = np.linalg.norm(v, axis=1, keepdims=True) + 1e-12
-    return v / norms
+    # 原地修改 v：einsum 直接求行平方和，不生成平方后的临时数组
+    norms = np.sqrt(np.einsum("ij,ij->i", v, v))[:, None]
+    np.add(norms, 1e-12, out=norms)
+    np.divide(v, norms, out=v)
+    return v
+
+def embed_batch(batch: List[str]) -> List[List[float]]:
+    """嵌入一批文本，遇到限流时指数退避重试"""
+    for attempt in range(EMBED_MAX_RETRIES):
+        try:
+            resp = client.embeddings.create(model=EMBED_MODEL, input=batch)
+            return [d.embedding for d in resp.data]
+        except RateLimitError:
+            if attempt == EMBED_MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
 
 def embed_texts(texts: List[str]) -> np.ndarray:
-    """调用 OpenAI 嵌入 API，批量生成向量"""
-    vecs = []
-    for i in range(0, len(texts), EMBED_BATCH):
-        batch = texts[i:i+EMBED_BATCH]
-        resp = client.embeddings.create(model=EMBED_MODEL, input=batch)
-        vecs.extend([d.embedding for d in resp.data])
-        # 轻微休眠，友好限流
-        time.sleep(0.05)
-    arr = np.array(vecs, dtype="float32")
+    """调用 OpenAI 嵌入 API，批量生成向量（多批时并发请求）"""
+    batches = [texts[i:i+EMBED_BATCH] for i in range(0, len(texts), EMBED_BATCH)]
+    if len(batches) <= 1:
+        results = [embed_batch(b) for b in batches]
+    else:
+        # map 按提交顺序返回，向量顺序与 texts 一致
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+            results = list(executor.map(embed_batch, batches))
+    arr = np.array([v for vecs in results for v in vecs], dtype="float32")
     return normalize(arr)
 
-def chunk_text(text: str, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> List[str]:
-    text = (text or "").strip()
-    if not text:
-        return []
-    chunks = []
+# 断句位置，按优先级排列
+SENT_BREAKS = ["\n\n", "\n", "。", "！", "？", ".", "!", "?"]
+
+def find_cut(text: str, start: int, end: int, size=CHUNK_SIZE) -> int:
+    """在窗口 text[start:end] 内找断开位置：尽量在句号/换行处断开"""
+    for sep in SENT_BREAKS:
+        pos = text.rfind(sep, start, end)
+        if pos != -1 and pos > start + size * 0.6:
+            return pos + len(sep)
+    return end
+
+NON_SPACE_RE = re.compile(r"\S")
+
+def iter_chunks(pieces: Iterable[str], size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> Iterator[str]:
+    """对分段读入的文本做滑动窗口切分，只在内存中保留当前窗口附近的文本
+
+    结果与对拼接后的整段文本调用 chunk_text 完全相同。
+    """
+    pieces = iter(pieces)
+    buf = ""        # 尚未丢弃的文本，buf[0] 对应全文位置 base
+    base = 0
     start = 0
-    n = len(text)
-    while start < n:
-        end = min(start + size, n)
-        # 尽量在句号/换行处断开
-        cut = end
-        for sep in ["\n\n", "\n", "。", "！", "？", ".", "!", "?"]:
-            pos = text.rfind(sep, start, end)
-            if pos != -1 and pos > start + size * 0.6:
-                cut = pos + len(sep)
-                break
-        chunk = text[start:cut]
-        chunks.append(chunk.strip())
-        start = max(cut - overlap, start + 1)
-    # 去空
-    return [c for c in chunks if c]
-
-def load_txt(path: Path) -> str:
-    try:
-        return path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        return path.read_text(encoding="utf-8", errors="ignore")
+    eof = False
+    while True:
+        # 窗口之后须已读到非空白字符（或已到结尾），才能确定窗口不受全文末尾 strip 的影响
+        while not eof and NON_SPACE_RE.search(buf, start - base + size) is None:
+            piece = next(pieces, None)
+            if piece is None:
+                eof = True
+                buf = buf.rstrip()
+            else:
+                buf += piece
+                if start == 0 and base == 0:
+                    buf = buf.lstrip()
+        if start - base >= len(buf):
+            break
+        end = min(start - base + size, len(buf))
+        cut = find_cut(buf, start - base, end, size)
+        chunk = buf[start - base:cut].strip()
+        if chunk:
+            yield chunk
+        start = max(cut + base - overlap, start + 1)
+        # 已处理的前缀超过一半时才丢弃，避免每个窗口都复制整个缓冲区
+        if start - base > len(buf) // 2:
+            buf = buf[start - base:]
+            base = start
+
+def chunk_text(text: str, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> List[str]:
+    return list(iter_chunks([text or ""], size, overlap))
+
+def iter_txt(path: Path, piece_chars=1 << 20) -> Iterator[str]:
+    """分段读取 txt，不一次性载入整个文件（非法 UTF-8 字节忽略）"""
+    with open(path, "r", encoding="utf-8", errors="ignore") as fr:
+        yield from iter(lambda: fr.read(piece_chars), "")
 
 def ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
+def build_faiss_index(emb: np.ndarray):
+    """按规模选择 FAISS 索引（内积 = 余弦）：小库用 HNSW，大库用 IVFPQ 量化压缩内存"""
+    n, dim = emb.shape
+    if n >= IVFPQ_MIN_COUNT and dim % PQ_M == 0:
+        # float32 (4 字节/维) 压缩为 PQ_M 字节/条，需先训练聚类中心和码本
+        nlist = math.isqrt(n) * 4
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        index.train(emb)
+        index.add(emb)
+        return index
+    # HNSW 检索为近似 O(log N) 而非全量扫描
+    index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(emb)
+    return index
+
+def load_previous_chunks(kb_dir: Path) -> Tuple[Dict[str, Tuple[str, int]], Optional[faiss.Index]]:
+    """读取已有知识库：{块 id: (文本, 行号)} 与旧索引，供增量构建复用向量
+
+    仅当旧索引保存原始向量（Flat/HNSW）且嵌入模型一致时可复用；
+    IVFPQ 只存量化编码，重建出的向量有损，复用会逐次累积误差。
+    """
+    index_path = kb_dir / "index.faiss"
+    meta_path  = kb_dir / "meta.jsonl"
+    info_path  = kb_dir / "kb_info.json"
+    if not (index_path.exists() and meta_path.exists() and info_path.exists()):
+        return {}, None
+    if json.loads(info_path.read_text(encoding="utf-8")).get("embed_model") != EMBED_MODEL:
+        return {}, None
+    index = faiss.read_index(str(index_path))
+    if hasattr(index, "nprobe"):
+        return {}, None
+    rows = {}
+    with meta_path.open("rb") as fr:
+        for row, line in enumerate(fr):
+            rec = json_loads(line)
+            rows[rec["meta"]["id"]] = (rec["text"], row)
+    return rows, index
+
 def build_index_from_folder(src_dir: Path, kb_dir: Path):
     ensure_dir(kb_dir)
     index_path = kb_dir / "index.faiss"
     meta_path  = kb_dir / "meta.jsonl"
     info_path  = kb_dir / "kb_info.json"
+    texts_path = kb_dir / "texts.bin"
+    offsets_path = kb_dir / "offsets.npy"
 
     texts, metas = [], []
     console = Console()
@@ -104,35 +216,57 @@ def build_index_from_folder(src_dir: Path, kb_dir: Path):
 
     with console.status("[bold green]正在切分与收集文本..."):
         for f in files:
-            raw = load_txt(f)
             # 用文件名作为标题，首行可能也含关键信息
             title = f.stem
-            # 合并：标题 + 正文
-            content = f"# {title}\n\n{raw}"
-            chunks = chunk_text(content)
+            # 合并：标题 + 正文（正文分段流式读入切分）
+            chunks = iter_chunks(itertools.chain([f"# {title}\n\n"], iter_txt(f)))
+            digest = file_digest(f)
             for idx, ck in enumerate(chunks):
                 texts.append(ck)
                 metas.append({
-                    "id": f"{file_sha1(f)}-{idx}",
+                    "id": f"{digest}-{idx}",
                     "file": str(f),
                     "title": title,
                     "chunk_index": idx,
                 })
 
+    # 增量构建：id 含文件指纹，内容未变的块直接复用旧索引中的向量
+    old_rows, old_index = load_previous_chunks(kb_dir)
+    reuse_pos, reuse_rows, new_pos = [], [], []
+    for i, (m, t) in enumerate(zip(metas, texts)):
+        hit = old_rows.get(m["id"])
+        if hit is not None and hit[0] == t:
+            reuse_pos.append(i)
+            reuse_rows.append(hit[1])
+        else:
+            new_pos.append(i)
+
     with console.status("[bold green]正在计算嵌入向量..."):
-        emb = embed_texts(texts)  # (N, D)
+        if reuse_pos:
+            emb = np.empty((len(texts), old_index.d), dtype="float32")
+            emb[reuse_pos] = old_index.reconstruct_n(0, old_index.ntotal)[reuse_rows]
+            if new_pos:
+                emb[new_pos] = embed_texts([texts[i] for i in new_pos])
+        else:
+            emb = embed_texts(texts)  # (N, D)
         dim = emb.shape[1]
+    print(f"复用已有向量 {len(reuse_pos)} 条，新计算 {len(new_pos)} 条")
 
-    # FAISS 索引（内积 = 余弦）
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb)
+    index = build_faiss_index(emb)
 
     faiss.write_index(index, str(index_path))
     # 元信息写 jsonl
-    with meta_path.open("w", encoding="utf-8") as fw:
+    with meta_path.open("wb") as fw:
         for m, t in zip(metas, texts):
-            rec = {"meta": m, "text": t}
-            fw.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            fw.write(json_line({"meta": m, "text": t}))
+    # 文本块另存为连续的 UTF-8 字节 + 偏移表，检索时按需内存映射读取
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with texts_path.open("wb") as fb:
+        for i, t in enumerate(texts):
+            b = t.encode("utf-8")
+            fb.write(b)
+            offsets[i + 1] = offsets[i] + len(b)
+    np.save(offsets_path, offsets)
 
     kb_info = {
         "dim": dim,
@@ -149,16 +283,55 @@ def build_index_from_folder(src_dir: Path, kb_dir: Path):
     print(table)
     print(f"[bold]索引文件：[/] {index_path}")
     print(f"[bold]元信息：[/] {meta_path}")
+    # 知识库已重建，丢弃同一进程内缓存的旧数据
+    _load_kb.cache_clear()
 
 def load_kb(kb_dir: Path):
+    """加载索引与元信息；同一进程内按目录缓存，多次查询不再重复读盘解析"""
+    return _load_kb(str(Path(kb_dir).resolve()))
+
+class ChunkTexts:
+    """按偏移表从内存映射的 texts.bin 中取文本块，只解码用到的条目"""
+
+    def __init__(self, texts_path: Path, offsets_path: Path):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        with open(texts_path, "rb") as fb:
+            # 空文件无法 mmap；映射建立后即可关闭文件句柄
+            self._buf = mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(fb.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._buf[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+
+@functools.lru_cache(maxsize=4)
+def _load_kb(kb_dir: str):
+    kb_dir = Path(kb_dir)
     index = faiss.read_index(str(kb_dir / "index.faiss"))
+    if hasattr(index, "hnsw"):
+        # 旧版知识库为 IndexFlatIP，没有 hnsw 参数
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif hasattr(index, "nprobe"):
+        index.nprobe = IVF_NPROBE
+    texts_path = kb_dir / "texts.bin"
+    offsets_path = kb_dir / "offsets.npy"
+    # 旧版知识库没有 texts.bin，文本仍从 meta.jsonl 读入内存
+    mapped = texts_path.exists() and offsets_path.exists()
     metas = []
-    texts = []
+    texts = ChunkTexts(texts_path, offsets_path) if mapped else []
     with (kb_dir / "meta.jsonl").open("r", encoding="utf-8") as fr:
         for line in fr:
-            rec = json.loads(line)
+            rec = json_loads(line)
             metas.append(rec["meta"])
-            texts.append(rec["text"])
+            if not mapped:
+                texts.append(rec["text"])
     return index, metas, texts
 
 def search_kb(kb_dir: Path, query: str, top_k=TOP_K) -> List[Dict]: